@@ -1,255 +1,540 @@
-from bottle import route, run, request, HTTPResponse
+from starlette.applications import Starlette
+from urllib.parse import parse_qs
+import uvicorn
 import random, json
-import threading
+import functools
+import contextlib
+import logging
+import os
 import time
-import concurrent.futures
+import asyncio
 
 # API service lists for health checks
 INTERNAL_APIS = ["billing", "usage"]
 EXTERNAL_APIS = ["alipay", "sms"]
 
-# Global cache for the latest check results
+# Static check names, in the order run_checks() reports them
+CRITICAL_NAMES = ("db_connection", "config_service", *(f"internal_api/{n}" for n in INTERNAL_APIS))
+EXTERNAL_NAMES = tuple(f"external_api/{n}" for n in EXTERNAL_APIS)
+
+# Static text table cells, padded to the column widths once
+TABLE_HEADER = f"{'CHECK':<24}{'STATUS':<8}MESSAGE"
+CRITICAL_PADDED_NAMES = tuple(f"{n:<24}" for n in CRITICAL_NAMES)
+EXTERNAL_PADDED_NAMES = tuple(f"{n:<24}" for n in EXTERNAL_NAMES)
+STATUS_CELLS = (f"{'✖':<8}", f"{'✔':<8}")   # indexed by ok
+
+# Static Prometheus sample prefixes, only the value is appended per refresh
+CRITICAL_METRIC_PREFIXES = tuple(f'healthcheck_status{{check="{n}",type="critical"}} ' for n in CRITICAL_NAMES)
+EXTERNAL_METRIC_PREFIXES = tuple(f'healthcheck_status{{check="{n}",type="external"}} ' for n in EXTERNAL_NAMES)
+METRICS_HEADER = (
+    "# HELP healthcheck_status Health check status (1=ok,0=error)",
+    "# TYPE healthcheck_status gauge"
+)
+
+# Global cache for the latest check results, stored as parallel
+# status/message/staleness tuples aligned with CRITICAL_NAMES and EXTERNAL_NAMES
 last_check_results = {
-    "critical": [],
-    "external": [],
-    "timestamp": 0
+    "critical_ok": (),
+    "critical_msgs": (),
+    "critical_stale": (),
+    "external_ok": (),
+    "external_msgs": (),
+    "external_stale": (),
+    "timestamp": 0,
+    "snapshot_str": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(0)),
+    "failed": False,
+    "code": 200,
+    "error": None       # set when results can no longer be trusted
 }
 
-# Maximum timeout per check (seconds)
+# Wall-clock budget for a full round of checks (seconds)
 CHECK_TIMEOUT = 5
 
-# Background check interval (seconds)
-CHECK_INTERVAL = 15
+# Background scan interval (seconds); each check only re-runs once its TTL expires
+CHECK_INTERVAL = 1
 
-def check_db_connection():
-    """
-    Simulate database connection health check
-    - 2% chance of timeout (simulates network issues)
-    - 98% success rate (simulates normal operation)
-    """
-    # Simulate timeout scenario
-    if random.random() < 0.02:
-        time.sleep(CHECK_TIMEOUT + 1)
-        return ("db_connection", False, "db_connection timed out")
+# Per-check refresh TTLs (seconds)
+CORE_CHECK_TTL = 30     # database and config service
+API_CHECK_TTL = 15      # internal and external APIs
+
+# Number of server worker processes (opt-in, defaults to 1).
+# Each worker runs its own checks and keeps its own result cache, so with
+# several workers the reported status may differ per connection.
+WORKERS = int(os.environ.get("WORKERS", 1))
+
+# Reuse uvicorn's error logger so background failures show up in the server log
+logger = logging.getLogger("uvicorn.error")
+
+# Cache hints for probes and reverse proxies. Healthy /healthz responses may be
+# reused until the next scan, unhealthy ones must never be served from a cache.
+CACHE_CONTROL = f"max-age={CHECK_INTERVAL}".encode()
+UNHEALTHY_CACHE_CONTROL = b"no-store"
+METRICS_CACHE_CONTROL = f"max-age={CHECK_INTERVAL}, stale-while-revalidate={API_CHECK_TTL}".encode()
+
+# How long a timed out check may keep serving its last known result (seconds)
+STALE_TTL = 60
+
+# Last completed (non-timeout) result per check: name -> (ok, msg, monotonic time)
+last_known_results = {}
 
-    # Simulate connection success/failure
-    ok = random.random() < 0.98
-    msg = "Database is connected" if ok else "Database connection failed"
-    return ("db_connection", ok, msg)
+# Latest result per check: name -> (name, ok, msg, stale_seconds)
+current_results = {}
 
-def check_config_service():
+# When each check was last started: name -> monotonic time
+last_run_times = {}
+
+# Each simulated check takes a single uniform draw and maps it onto
+# outcome ranges: [0, TIMEOUT) timeout, [TIMEOUT, FAILURE) failure, rest success
+CHECK_TIMEOUT_CUTOFF = 0.02                          # ~2% timeout rate
+CHECK_FAILURE_CUTOFF = 0.02 + 0.98 * 0.02            # ~98% success otherwise
+API_FAILURE_CUTOFF = 0.02 + 0.98 * 0.13              # ~13% API error rate otherwise
+
+async def check_core_service(name, ok_msg, error_msg):
     """
-    Simulate configuration service health check
-    - 2% chance of timeout (simulates service unavailability)
+    Simulate a core service health check (database, config service)
+    - 2% chance of timeout (simulates network issues or service unavailability)
     - 98% success rate (simulates normal operation)
     """
+    roll = random.random()
+
     # Simulate timeout scenario
-    if random.random() < 0.02:
-        time.sleep(CHECK_TIMEOUT + 1)
-        return ("config_service", False, "config_service timed out")
+    if roll < CHECK_TIMEOUT_CUTOFF:
+        await asyncio.sleep(CHECK_TIMEOUT + 1)
+        return (name, False, f"{name} timed out")
 
-    # Simulate service availability
-    ok = random.random() < 0.98
-    msg = "Config service is reachable" if ok else "Config service error"
-    return ("config_service", ok, msg)
+    # Simulate service success/failure
+    ok = roll >= CHECK_FAILURE_CUTOFF
+    return (name, ok, ok_msg if ok else error_msg)
 
-def check_apis(api_list, prefix):
+async def check_one_api(name, prefix):
     """
-    Simulate API health checks with realistic failure patterns
+    Simulate a single API health check with realistic failure patterns
     - 2% timeout rate (simulates network issues)
     - 13% error rate (simulates API errors)
     - Variable latency (50-500ms) for successful calls
     """
+    roll = random.random()
+    svc = f"{prefix}/{name}"
+
+    if roll < CHECK_TIMEOUT_CUTOFF:
+        # Simulate timeout by exceeding the check timeout
+        await asyncio.sleep(CHECK_TIMEOUT + 1)
+        return (svc, False, f"{svc} timed out")
+
+    if roll < API_FAILURE_CUTOFF:
+        # Simulate API error response
+        return (svc, False, f"{svc} returned error")
+
+    # Simulate successful API call with realistic latency,
+    # scaling the rest of the draw onto 50-500ms
+    latency = 50 + int((roll - API_FAILURE_CUTOFF) / (1 - API_FAILURE_CUTOFF) * 451)
+    await asyncio.sleep(latency / 1000.0)  # Convert ms to seconds
+    return (svc, True, f"{svc} OK ({latency}ms)")
+
+# Check registry: (name, check coroutine function, TTL in seconds)
+CORE_CHECKS = (
+    ("db_connection", functools.partial(
+        check_core_service, "db_connection", "Database is connected", "Database connection failed"
+    ), CORE_CHECK_TTL),
+    ("config_service", functools.partial(
+        check_core_service, "config_service", "Config service is reachable", "Config service error"
+    ), CORE_CHECK_TTL)
+)
+INTERNAL_CHECKS = tuple(
+    (f"internal_api/{n}", functools.partial(check_one_api, n, "internal_api"), API_CHECK_TTL)
+    for n in INTERNAL_APIS
+)
+EXTERNAL_CHECKS = tuple(
+    (f"external_api/{n}", functools.partial(check_one_api, n, "external_api"), API_CHECK_TTL)
+    for n in EXTERNAL_APIS
+)
+
+def due_checks(checks):
+    """
+    Start the checks whose TTL has elapsed since their last run
+    Returns (name, coroutine) pairs ready for collect_checks()
+    """
+    now = time.monotonic()
+    due = []
+    for name, check, ttl in checks:
+        last_run = last_run_times.get(name)
+        if last_run is None or now - last_run >= ttl:
+            last_run_times[name] = now
+            due.append((name, check()))
+    return due
+
+async def collect_checks(checks, deadline):
+    """
+    Run named checks concurrently against a shared wall-clock deadline
+    - Results are returned in the same order as the given checks
+    - Checks still pending at the deadline are cancelled; they fall back to their
+      last known result for up to STALE_TTL seconds, otherwise report a timeout
+    - Each result carries its staleness in seconds (0 for a fresh result)
+    """
+    tasks = {name: asyncio.create_task(coro) for name, coro in checks}
+    if not tasks:
+        return []
+    remaining = max(0, deadline - asyncio.get_running_loop().time())
+    await asyncio.wait(tasks.values(), timeout=remaining)
+
+    now = time.monotonic()
     results = []
-    for name in api_list:
-        timeout = random.random() < 0.02  # ~2% timeout rate
-        svc = f"{prefix}/{name}"
-
-        if timeout:
-            # Simulate timeout by exceeding the check timeout
-            time.sleep(CHECK_TIMEOUT + 1)
-            msg = f"{svc} timed out"
-            ok = False
+    for name, task in tasks.items():
+        if task.done():
+            _, ok, msg = task.result()
+            last_known_results[name] = (ok, msg, now)
+            results.append((name, ok, msg, 0))
+            continue
+
+        task.cancel()
+        last_known = last_known_results.get(name)
+        if last_known and now - last_known[2] < STALE_TTL:
+            # Serve the last known result instead of flapping to a failure
+            ok, msg, checked_at = last_known
+            age = int(now - checked_at)
+            results.append((name, ok, f"{msg} (stale {age}s)", age))
         else:
-            error = random.random() < 0.13  # ~13% error rate
-            if error:
-                # Simulate API error response
-                msg = f"{svc} returned error"
-                ok = False
-            else:
-                # Simulate successful API call with realistic latency
-                latency = random.randint(50, 500)
-                time.sleep(latency / 1000.0)  # Convert ms to seconds
-                msg = f"{svc} OK ({latency}ms)"
-                ok = True
-        results.append((svc, ok, msg))
+            results.append((name, False, f"{name} timed out", 0))
     return results
 
-def run_checks():
+async def run_critical_checks(deadline):
+    """
+    Execute due critical checks followed by dependent internal API checks
+    - Database and config service are checked concurrently
+    - Internal APIs: only checked if critical checks pass (dependency chain)
+    Returns the number of checks that ran
+    """
+    core_results = await collect_checks(due_checks(CORE_CHECKS), deadline)
+    current_results.update((result[0], result) for result in core_results)
+
+    # Check internal APIs only if critical services are healthy
+    if all(current_results[name][1] for name, _, _ in CORE_CHECKS):
+        # The core stage used up the budget: leave internal APIs unstamped so
+        # the next scan runs them, keeping any previous result until then
+        if asyncio.get_running_loop().time() >= deadline:
+            for name, _, _ in INTERNAL_CHECKS:
+                current_results.setdefault(name, (name, False, "Skipped: check budget exhausted", 0))
+            return len(core_results)
+
+        # Internal APIs depend on critical services being available
+        internal_results = await collect_checks(due_checks(INTERNAL_CHECKS), deadline)
+        current_results.update((result[0], result) for result in internal_results)
+        return len(core_results) + len(internal_results)
+
+    # Skip internal API checks if critical services failed
+    for name, _, _ in INTERNAL_CHECKS:
+        current_results[name] = (name, False, "Skipped due to upstream failure", 0)
+        # Re-check as soon as the upstream services recover
+        last_run_times.pop(name, None)
+    return len(core_results)
+
+async def run_external_checks(deadline):
     """
-    Execute all health checks concurrently with timeout protection
+    Execute due external API checks concurrently (independent of critical services)
+    Returns the number of checks that ran
+    """
+    external_results = await collect_checks(due_checks(EXTERNAL_CHECKS), deadline)
+    current_results.update((result[0], result) for result in external_results)
+    return len(external_results)
+
+async def run_checks():
+    """
+    Execute all due health checks concurrently on a single event loop
     - Critical checks: database and config service (required for operation)
     - Internal APIs: only checked if critical checks pass (dependency chain)
-    - External APIs: always checked (independent services)
+    - External APIs: always checked, in parallel with the critical chain
+    - Each check only re-runs once its own TTL has expired
+    - The whole round shares one CHECK_TIMEOUT budget, so a stuck check
+      cannot delay it beyond that
+    Updates current_results and returns the number of checks that ran
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Execute critical infrastructure checks concurrently
-        critical_futures = {
-            "db_connection": executor.submit(check_db_connection),
-            "config_service": executor.submit(check_config_service)
-        }
-        critical_results = []
-
-        # Collect critical check results with timeout handling
-        for name, future in critical_futures.items():
-            try:
-                critical_results.append(future.result(timeout=CHECK_TIMEOUT))
-            except concurrent.futures.TimeoutError:
-                critical_results.append((name, False, f"{name} timed out"))
-
-        # Check internal APIs only if critical services are healthy
-        if all(ok for _, ok, _ in critical_results):
-            # Internal APIs depend on critical services being available
-            internal_futures = {
-                n: executor.submit(lambda name: check_apis([name], "internal_api")[0], n)
-                for n in INTERNAL_APIS
+    deadline = asyncio.get_running_loop().time() + CHECK_TIMEOUT
+    critical_count, external_count = await asyncio.gather(
+        run_critical_checks(deadline),
+        run_external_checks(deadline)
+    )
+    return critical_count + external_count
+
+def render_text(results, snapshot_str):
+    """
+    Render the human-readable table for /healthz (text format)
+    """
+    title = f"HEALTH CHECK SNAPSHOT [{snapshot_str}]"
+    border = "-" * len(title)
+
+    return "\n".join([
+        title, border,
+        # Report a broken refresher above the (now outdated) table
+        *([f"ERROR: {results['error']}"] if results["error"] else []),
+        TABLE_HEADER,
+        # Format critical checks section
+        "----- CRITICAL -----",
+        *[name + STATUS_CELLS[ok] + msg for name, ok, msg in zip(
+            CRITICAL_PADDED_NAMES, results["critical_ok"], results["critical_msgs"]
+        )],
+        # Format external checks section
+        "----- EXTERNAL -----",
+        *[name + STATUS_CELLS[ok] + msg for name, ok, msg in zip(
+            EXTERNAL_PADDED_NAMES, results["external_ok"], results["external_msgs"]
+        )]
+    ]).encode()
+
+def render_json(results, snapshot_str):
+    """
+    Render the structured payload for /healthz?format=json
+    - Returns (compact_bytes, pretty_bytes); pretty output is served with ?pretty=1
+    """
+    failed = results["failed"]
+    critical_checks = [
+        {"name": name, "status": "ok" if ok else "error", "message": msg, "stale_seconds": stale}
+        for name, ok, msg, stale in zip(
+            CRITICAL_NAMES, results["critical_ok"], results["critical_msgs"], results["critical_stale"]
+        )
+    ]
+    external_checks = [
+        {"name": name, "status": "ok" if ok else "error", "message": msg, "stale_seconds": stale}
+        for name, ok, msg, stale in zip(
+            EXTERNAL_NAMES, results["external_ok"], results["external_msgs"], results["external_stale"]
+        )
+    ]
+    body = {
+        "status": "ok" if not failed else "error",
+        "data": {
+            "message": results["error"] or (
+                "All critical checks passed" if not failed else "Some critical checks failed"
+            ),
+            "snapshot_time": snapshot_str,
+            "checks": {
+                "critical": critical_checks,
+                "external": external_checks
             }
-            for name, future in internal_futures.items():
-                try:
-                    critical_results.append(future.result(timeout=CHECK_TIMEOUT))
-                except concurrent.futures.TimeoutError:
-                    critical_results.append((f"internal_api/{name}", False, f"internal_api/{name} timed out"))
-        else:
-            # Skip internal API checks if critical services failed
-            for name in INTERNAL_APIS:
-                svc = f"internal_api/{name}"
-                critical_results.append((svc, False, "Skipped due to upstream failure"))
-
-        # External API checks (independent of critical services)
-        external_results = []
-        external_futures = {
-            n: executor.submit(lambda name: check_apis([name], "external_api")[0], n)
-            for n in EXTERNAL_APIS
         }
-        for name, future in external_futures.items():
-            try:
-                external_results.append(future.result(timeout=CHECK_TIMEOUT))
-            except concurrent.futures.TimeoutError:
-                external_results.append((f"external_api/{name}", False, f"external_api/{name} timed out"))
+    }
+    return json.dumps(body, separators=(',', ':')).encode(), json.dumps(body, indent=2).encode()
+
+def render_metrics(results):
+    """
+    Render Prometheus metrics for /metrics
+    - Exports health check status as gauge metrics
+    - Labels distinguish between critical and external checks
+    - Values: 1 for healthy, 0 for unhealthy
+    """
+    return "\n".join([
+        *METRICS_HEADER,
+        # Export critical check metrics
+        *[p + ("1" if ok else "0") for p, ok in zip(CRITICAL_METRIC_PREFIXES, results["critical_ok"])],
+        # Export external check metrics
+        *[p + ("1" if ok else "0") for p, ok in zip(EXTERNAL_METRIC_PREFIXES, results["external_ok"])]
+    ]).encode()
 
-    return critical_results, external_results
+def render_all(results):
+    """
+    Pre-render every response body once per refresh
+    - Returns (code, text_bytes, json_bytes, json_pretty_bytes, metrics_bytes, text_etag, json_etag)
+    - ETags are derived from the snapshot time and status code
+    - Request handlers only pick the matching body out of the tuple
+    """
+    snapshot_str = results["snapshot_str"]
+    etag_base = f'{int(results["timestamp"] * 1000)}-{results["code"]}'
+    json_body, json_pretty_body = render_json(results, snapshot_str)
+
+    return (
+        results["code"],
+        render_text(results, snapshot_str),
+        json_body,
+        json_pretty_body,
+        render_metrics(results),
+        f'W/"{etag_base}-text"'.encode(),
+        f'W/"{etag_base}-json"'.encode()
+    )
 
-def background_check_loop():
+# Pre-rendered responses, swapped as a whole tuple on every refresh
+CACHE = render_all(last_check_results)
+
+async def check_loop():
     """
-    Background thread that periodically refreshes health check results
-    - Runs every CHECK_INTERVAL seconds
-    - Updates global cache with latest results
-    - Provides cached responses for better performance
+    Periodically refresh health check results on the event loop
     """
+    global CACHE
     while True:
-        critical, external = run_checks()
-        last_check_results["critical"] = critical
-        last_check_results["external"] = external
+        # Nothing to refresh until at least one check's TTL has expired
+        if not await run_checks():
+            await asyncio.sleep(CHECK_INTERVAL)
+            continue
+
+        # Split result tuples into status/message/staleness columns; names are static
+        _, critical_ok, critical_msgs, critical_stale = zip(*(current_results[n] for n in CRITICAL_NAMES))
+        _, external_ok, external_msgs, external_stale = zip(*(current_results[n] for n in EXTERNAL_NAMES))
+        last_check_results["critical_ok"] = critical_ok
+        last_check_results["critical_msgs"] = critical_msgs
+        last_check_results["critical_stale"] = critical_stale
+        last_check_results["external_ok"] = external_ok
+        last_check_results["external_msgs"] = external_msgs
+        last_check_results["external_stale"] = external_stale
         last_check_results["timestamp"] = time.time()
-        time.sleep(CHECK_INTERVAL)
+        last_check_results["snapshot_str"] = time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(last_check_results["timestamp"])
+        )
+
+        # Determine overall health status based on critical checks
+        failed = not all(critical_ok)
+        last_check_results["failed"] = failed
+        last_check_results["code"] = 500 if failed else 200
+
+        CACHE = render_all(last_check_results)
+        await asyncio.sleep(CHECK_INTERVAL)
+
+def report_check_loop_exit(task):
+    """
+    Handle the background check loop dying unexpectedly
+    - Logs the traceback
+    - Switches the cached responses to 500 so probes see the refresher is dead
+    """
+    global CACHE
+    if task.cancelled() or task.exception() is None:
+        return
+
+    logger.error("Health check loop stopped, cached results are no longer refreshed",
+                 exc_info=task.exception())
+    last_check_results["timestamp"] = time.time()
+    last_check_results["snapshot_str"] = time.strftime(
+        '%Y-%m-%d %H:%M:%S', time.localtime(last_check_results["timestamp"])
+    )
+    last_check_results["failed"] = True
+    last_check_results["code"] = 500
+    last_check_results["error"] = "Health check loop stopped"
+    CACHE = render_all(last_check_results)
 
-# Start the background health check thread
-threading.Thread(target=background_check_loop, daemon=True).start()
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """
+    Run the background health check loop alongside the server
+    - Scheduled on the server's own event loop, no extra thread
+    - Scans every CHECK_INTERVAL seconds and re-runs checks whose TTL expired
+    - Logs the error if the loop crashes, cancelled and awaited on shutdown
+    """
+    task = asyncio.create_task(check_loop())
+    task.add_done_callback(report_check_loop_exit)
+    yield
+
+    # A crashed loop has already been reported by its done-callback
+    if not task.done():
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+def etag_matches(if_none_match, etag):
+    """
+    Weakly compare an If-None-Match header value against the current ETag
+    - The W/ prefix is ignored on both sides
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == b"*":
+        return True
+    opaque_tag = etag.removeprefix(b"W/")
+    return any(t.strip().removeprefix(b"W/") == opaque_tag for t in if_none_match.split(b","))
 
-@route('/healthz')
-def healthz():
+def healthz(query, headers):
     """
     Health check endpoint with two output formats:
     - Text format (default): Human-readable table format
-    - JSON format: Structured data for programmatic consumption
-    """
-    fmt = request.query.get("format")
-
-    # Read from cached results for better performance
-    critical_results = last_check_results["critical"]
-    external_results = last_check_results["external"]
-    ts = last_check_results["timestamp"]
-    snapshot_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
-
-    # Determine overall health status based on critical checks
-    failed = any(not ok for _, ok, _ in critical_results)
-    code = 500 if failed else 200
-
-    # JSON format for programmatic consumption
-    if fmt == "json":
-        # Structure data for JSON response
-        critical_checks = [
-            {"name": name, "status": "ok" if ok else "error", "message": msg}
-            for name, ok, msg in critical_results
-        ]
-        external_checks = [
-            {"name": name, "status": "ok" if ok else "error", "message": msg}
-            for name, ok, msg in external_results
-        ]
-        body = {
-            "status": "ok" if not failed else "error",
-            "data": {
-                "message": "All critical checks passed" if not failed else "Some critical checks failed",
-                "snapshot_time": snapshot_str,
-                "checks": {
-                    "critical": critical_checks,
-                    "external": external_checks
-                }
-            }
-        }
-        return HTTPResponse(json.dumps(body, indent=2), status=code, content_type='application/json')
+    - JSON format: Structured data for programmatic consumption (?pretty=1 to indent)
+    - Answers 304 Not Modified when healthy and If-None-Match matches the snapshot ETag
+    - Unhealthy responses ignore If-None-Match and are never cacheable
+    Returns (status, headers, body) for the ASGI interceptor
+    """
+    code, text_body, json_body, json_pretty_body, _, text_etag, json_etag = CACHE
 
+    # JSON format for programmatic consumption, compact unless ?pretty=1
+    if query.get("format", [None])[0] == "json":
+        if query.get("pretty", [None])[0] == "1":
+            json_body = json_pretty_body
+        content_type, body, etag = b"application/json", json_body, json_etag
     # Text format for human readability (default)
-    title = f"HEALTH CHECK SNAPSHOT [{snapshot_str}]"
-    border = "-" * len(title)
-    table_header = f"{'CHECK':<24}{'STATUS':<8}MESSAGE"
-    lines = [title, border, table_header]
+    else:
+        content_type, body, etag = b"text/plain; charset=utf-8", text_body, text_etag
 
-    # Format critical checks section
-    lines.append("----- CRITICAL -----")
-    for name, ok, msg in critical_results:
-        status_text = "✔" if ok else "✖"
-        lines.append(f"{name:<24}{status_text:<8}{msg}")
+    # Preconditions only apply when the full response would be a 2xx
+    if code != 200:
+        return code, [
+            (b"content-type", content_type),
+            (b"etag", etag),
+            (b"cache-control", UNHEALTHY_CACHE_CONTROL)
+        ], body
 
-    # Format external checks section
-    lines.append("----- EXTERNAL -----")
-    for name, ok, msg in external_results:
-        status_text = "✔" if ok else "✖"
-        lines.append(f"{name:<24}{status_text:<8}{msg}")
+    if etag_matches(headers.get(b"if-none-match"), etag):
+        return 304, [(b"etag", etag), (b"cache-control", CACHE_CONTROL)], b""
 
-    return HTTPResponse("\n".join(lines), status=code, content_type='text/plain')
+    return code, [
+        (b"content-type", content_type),
+        (b"etag", etag),
+        (b"cache-control", CACHE_CONTROL)
+    ], body
 
-@route('/metrics')
-def metrics():
+def metrics(query, headers):
     """
     Prometheus metrics endpoint
-    - Exports health check status as gauge metrics
-    - Labels distinguish between critical and external checks
-    - Values: 1 for healthy, 0 for unhealthy
+    - Serves the metrics body pre-rendered by the background loop
     """
-    # Read from cached results
-    critical_results = last_check_results["critical"]
-    external_results = last_check_results["external"]
+    return 200, [
+        (b"content-type", b"text/plain; charset=utf-8"),
+        (b"cache-control", METRICS_CACHE_CONTROL)
+    ], CACHE[4]
 
-    # Prometheus metrics format
-    lines = [
-        "# HELP healthcheck_status Health check status (1=ok,0=error)",
-        "# TYPE healthcheck_status gauge"
-    ]
+def method_not_allowed(query, headers):
+    """
+    Reject methods other than GET/HEAD on the health endpoints
+    """
+    return 405, [
+        (b"content-type", b"text/plain; charset=utf-8"),
+        (b"allow", b"GET, HEAD")
+    ], b"Method Not Allowed"
+
+# Endpoints answered directly by the ASGI interceptor
+HEALTH_ROUTES = {
+    "/healthz": healthz,
+    "/metrics": metrics
+}
+
+class HealthCheckInterceptor:
+    """
+    Pure ASGI wrapper serving /healthz and /metrics
+    - Short-circuits probe traffic at the ASGI scope level
+    - Skips Starlette routing and middleware entirely for these paths
+    - Answers 405 for methods other than GET/HEAD on these paths
+    - Falls through to the wrapped application for everything else
+    """
+    def __init__(self, app):
+        self.app = app
 
-    # Export critical check metrics
-    for name, ok, _ in critical_results:
-        lines.append(f'healthcheck_status{{check="{name}",type="critical"}} {1 if ok else 0}')
+    async def __call__(self, scope, receive, send):
+        handler = None
+        if scope["type"] == "http":
+            handler = HEALTH_ROUTES.get(scope["path"])
+        if handler is None:
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] not in ("GET", "HEAD"):
+            handler = method_not_allowed
 
-    # Export external check metrics
-    for name, ok, _ in external_results:
-        lines.append(f'healthcheck_status{{check="{name}",type="external"}} {1 if ok else 0}')
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        status, headers, body = handler(query, dict(scope["headers"]))
+        if status != 304:
+            headers.append((b"content-length", str(len(body)).encode()))
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers
+        })
+        await send({"type": "http.response.body", "body": body})
 
-    return HTTPResponse("\n".join(lines), content_type='text/plain')
+app = HealthCheckInterceptor(Starlette(lifespan=lifespan))
 
 if __name__ == '__main__':
     print("Service endpoints available:")
     print("  Healthcheck (Text):  http://0.0.0.0:8080/healthz")
     print("  Healthcheck (JSON):  http://0.0.0.0:8080/healthz?format=json")
     print("  Prometheus metrics:  http://0.0.0.0:8080/metrics")
-    run(host='0.0.0.0', port=8080)
+    # Workers are started from an import string and share one listening socket
+    uvicorn.run("mock-healthz-metrics:app", host='0.0.0.0', port=8080, workers=WORKERS, backlog=2048)